@@ -1,16 +1,88 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
 import os
+import queue
 import random
+import shutil
 import string
+import subprocess
+import tempfile
+import threading
 import time
 import traceback  # For detailed error logging
 import uuid  # For unique filenames
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 
 import matplotlib.font_manager as fm
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 from dotenv import load_dotenv
-from flask import Flask, request, render_template, send_from_directory, url_for, flash, redirect
-from moviepy import ImageSequenceClip  # Use .editor for newer moviepy versions
+from flask import Flask, request, render_template, send_from_directory, url_for, flash, redirect, jsonify
+from werkzeug.security import safe_join
+
+from utils_numba import (build_radial_mask, composite_u8, gaussian_blur_u8, scratch_buffer, set_kernel_threads,
+                         warmup_kernels)
+
+# --- FFmpeg Binary ---
+# A system ffmpeg on PATH is preferred; imageio-ffmpeg ships a static build as a pip-only fallback.
+try:
+    import imageio_ffmpeg
+    IMAGEIO_FFMPEG_AVAILABLE = True
+except ImportError:
+    imageio_ffmpeg = None
+    IMAGEIO_FFMPEG_AVAILABLE = False
+
+
+def _find_ffmpeg():
+    """Returns the ffmpeg executable to encode with, or 'ffmpeg' if none can be located."""
+    system_ffmpeg = shutil.which('ffmpeg')
+    if system_ffmpeg:
+        return system_ffmpeg
+    if IMAGEIO_FFMPEG_AVAILABLE:
+        try:
+            return imageio_ffmpeg.get_ffmpeg_exe()
+        except RuntimeError as e:
+            print(f"Warning: imageio-ffmpeg could not provide an ffmpeg binary: {e}")
+    print("Warning: ffmpeg not found on PATH and imageio-ffmpeg is unavailable. Video encoding will fail.")
+    print("Install FFmpeg or run: pip install imageio-ffmpeg")
+    return 'ffmpeg'
+
+
+FFMPEG_EXE = _find_ffmpeg()
+
+
+def _probe_nvenc(ffmpeg_exe):
+    """True if ffmpeg can actually encode with h264_nvenc on this host.
+
+    `ffmpeg -encoders` lists NVENC in most builds even without an NVIDIA GPU or driver,
+    so one tiny frame is test-encoded instead.
+    """
+    command = [ffmpeg_exe, '-loglevel', 'error', '-f', 'lavfi', '-i', 'color=c=black:s=256x256',
+               '-frames:v', '1', '-c:v', 'h264_nvenc', '-f', 'null', '-']
+    try:
+        return subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, timeout=15).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+HAS_NVENC = _probe_nvenc(FFMPEG_EXE)
+if HAS_NVENC:
+    print("NVENC hardware encoder detected. Videos will be encoded with h264_nvenc.")
+
+# --- AI Snippet Cache (optional persistence) ---
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    diskcache = None
+    DISKCACHE_AVAILABLE = False
 
 # --- AI Integrations ---
 MISTRAL_AVAILABLE = False
@@ -65,6 +137,23 @@ WIDTH = 1024
 HEIGHT = 1024
 FPS = 10
 DURATION_SECONDS = 5
+FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Memory cap for rendered frames re-sent for identical later frames
+FRAME_QUEUE_SIZE = 8  # Frames buffered between the render loop and the ffmpeg writer thread
+RENDER_INFLIGHT_MAX_BYTES = 256 * 1024 * 1024  # Memory cap for frames rendered but not yet consumed
+RENDER_BUDGET_BYTES = 2 << 30  # Max raw RGB frame data (W*H*3*fps*duration) a single request may render
+MAX_RENDER_DIMENSION = 1440  # Larger videos are rendered at this size (longest side) and upscaled by ffmpeg
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium')  # Allowed encoder speed presets
+X264_PRESET = 'veryfast'  # Default: far faster than 'medium' with little visible difference for text
+
+# Background job settings
+GENERATION_WORKERS = 2  # Videos generated at the same time; further requests wait in the queue
+MAX_TRACKED_JOBS = 100  # Finished jobs whose status is remembered for /status polling
+OUTPUT_TTL_SECONDS = 24 * 60 * 60  # Generated videos unused for this long are deleted
+OUTPUT_SWEEP_INTERVAL_SECONDS = 10 * 60  # Minimum time between two sweeps of the output folder
+DOWNLOAD_MAX_AGE = 3600  # Cache-Control max-age (seconds) for downloaded videos
+# Behind nginx, set USE_XACCEL=1 so downloads are handed off with X-Accel-Redirect (see README)
+USE_XACCEL = os.environ.get("USE_XACCEL", "").lower() in ("1", "true", "yes")
+XACCEL_PREFIX = os.environ.get("XACCEL_PREFIX", "/_outputs/")  # nginx 'internal' location for the output folder
 
 # Text & Highlighting settings
 HIGHLIGHTED_TEXT = "Mother of Dragons"
@@ -80,6 +169,11 @@ VERTICAL_SPREAD_FACTOR = 1.5  # Multiplier for line height (1.0 = tight, 1.5 = l
 AI_GENERATION_ENABLED = MISTRAL_AVAILABLE  # Auto-disable if library missing
 UNIQUE_TEXT_COUNT = 2  # Number of unique text snippets to generate/pre-pool
 MISTRAL_MODEL = "mistral-large-latest"  # Or choose another suitable model
+GEMINI_MODEL = "models/gemini-1.5-flash-latest"
+AI_RATE_LIMIT_RETRIES = 3  # Retries (backoff 1s, 2s, 4s) after an HTTP 429; other errors are not retried
+AI_CACHE_MAX_ENTRIES = 1024  # In-memory memo of AI snippet sets per (provider, model, text, line range)
+AI_CACHE_DIR = os.path.join('cache', 'ai_snippets')  # On-disk copy of the memo (used if diskcache is installed)
+AI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
 # !! IMPORTANT: Load API Key securely !!
 MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
 
@@ -99,9 +193,129 @@ FALLBACK_CHAR_SET = string.ascii_lowercase + " "
 class FontLoadError(Exception): pass
 class FontDrawError(Exception): pass
 
+# Per-process font cache, filled once per render worker by _init_render_worker
+_FONT_CACHE = OrderedDict() # (font_path, font_size) -> ImageFont, least recently used first
+_FONT_CACHE_MAX_ENTRIES = 256
+
+def _load_font(font_path, font_size):
+    """Returns an ImageFont for (font_path, font_size), parsing the file only once per process."""
+    key = (font_path, font_size)
+    font = _FONT_CACHE.get(key)
+    if font is None:
+        font = ImageFont.truetype(font_path, font_size)
+        _FONT_CACHE[key] = font
+        if len(_FONT_CACHE) > _FONT_CACHE_MAX_ENTRIES:
+            _FONT_CACHE.popitem(last=False)
+    else:
+        _FONT_CACHE.move_to_end(key)
+    return font
+
+def _forget_font(font_path):
+    """Drops every cached object built from font_path (called when the font fails to render)."""
+    for key in [key for key in _FONT_CACHE if key[0] == font_path]:
+        del _FONT_CACHE[key]
+    for key in [key for key in _layout_cache if key[1] == font_path]:
+        del _layout_cache[key]
+    _load_font_bundle.cache_clear() # lru_cache has no per-key eviction; failures are rare
+    _render_highlight_tile.cache_clear()
+
+# Per-process drawing canvases, reused across frames instead of allocating new images
+_CANVASES = {}
+
+def _get_canvas(name, size, bg_color=None):
+    """Returns the reusable RGB canvas `name` of the given size, cleared to bg_color.
+
+    With bg_color=None the previous contents are left in place (for canvases that are
+    about to be fully overwritten).
+    """
+    key = (name, size)
+    canvas = _CANVASES.get(key)
+    if canvas is None:
+        canvas = _CANVASES[key] = Image.new('RGB', size, color=bg_color or 0)
+    elif bg_color is not None:
+        canvas.paste(bg_color, (0, 0) + size) # In-place fill, no new allocation
+    return canvas
+
+# Regular font path -> bold sibling path, built once per font discovery (see _discover_fonts)
+_BOLD_MAP = {}
+
+def _build_bold_map(font_paths):
+    """Pairs every regular font with its bold variant in a single pass over the file names."""
+    # Group by family name with the weight removed, e.g. 'Lato-Regular' and 'Lato-Bold' -> 'Lato'
+    families = {}
+    for path in font_paths:
+        directory, filename = os.path.split(path)
+        stem, ext = os.path.splitext(filename)
+        family = stem.replace("Regular", "").replace("regular", "").replace("Bold", "").replace("bold", "")
+        families.setdefault((directory, family.rstrip(" -_"), ext.lower()), []).append(path)
+
+    bold_map = {}
+    for members in families.values():
+        bold_paths = sorted((p for p in members if "bold" in os.path.basename(p).lower()), key=len)
+        if not bold_paths:
+            continue
+        for path in members:
+            if path not in bold_paths:
+                bold_map[path] = bold_paths[0]
+
+    # Short 'bd'/'b' suffixes used by some system fonts (e.g. arial.ttf -> arialbd.ttf)
+    by_stem = {os.path.splitext(path)[0]: path for path in font_paths}
+    for stem, path in by_stem.items():
+        for suffix in ("bd", "b"):
+            regular_path = by_stem.get(stem[:-len(suffix)]) if stem.endswith(suffix) else None
+            if regular_path and regular_path not in bold_map:
+                bold_map[regular_path] = path
+    return bold_map
+
+def _discover_fonts(font_dir):
+    """Lists usable font files (font_dir first, system fonts as fallback) and indexes their bold variants."""
+    font_paths = []
+    if font_dir and os.path.isdir(font_dir):
+        print(f"Looking for fonts in specified directory: {font_dir}")
+        for filename in os.listdir(font_dir):
+            if filename.lower().endswith((".ttf", ".otf")):
+                font_paths.append(os.path.join(font_dir, filename))
+    else:
+        print("FONT_DIR not specified or invalid, searching system fonts...")
+        try:
+            # Limit search to common locations if possible, or search all
+            font_paths = fm.findSystemFonts(fontpaths=None, fontext='ttf')
+            # font_paths.extend(fm.findSystemFonts(fontpaths=None, fontext='otf'))
+        except Exception as e:
+            print(f"Error finding system fonts: {e}")
+
+    _BOLD_MAP.update(_build_bold_map(font_paths))
+    return font_paths
+
+FontBundle = namedtuple('FontBundle', ['font', 'bold_font', 'ascent', 'descent',
+                                       'highlight_width_bold', 'highlight_bbox_h'])
+
+@lru_cache(maxsize=256)
+def _load_font_bundle(font_path, font_size, highlighted_text):
+    """Loads the regular/bold fonts for a frame and precomputes their metrics (cached)."""
+    font = _load_font(font_path, font_size)
+    bold_font = font  # Regular is the fallback when there is no (loadable) bold variant
+    bold_path = _BOLD_MAP.get(font_path, font_path)
+    if bold_path != font_path:
+        try:
+            bold_font = _load_font(bold_path, font_size)
+        except IOError:
+            pass
+
+    try:
+        ascent, descent = font.getmetrics()
+    except AttributeError:
+        bbox_line_test = font.getbbox("Ay", anchor="lt")
+        ascent, descent = bbox_line_test[3] - bbox_line_test[1], 0
+
+    return FontBundle(font, bold_font, ascent, descent,
+                      bold_font.getlength(highlighted_text),
+                      bold_font.getbbox(highlighted_text, anchor="lt"))
+
 def get_random_font(font_paths, exclude_list=None):
     """Selects a random font file path from the list, avoiding excluded ones."""
-    available_fonts = list(set(font_paths) - set(exclude_list or []))
+    # Pass an already-filtered sequence and no exclude_list to skip the filtering pass
+    available_fonts = [p for p in font_paths if p not in exclude_list] if exclude_list else font_paths
     if not available_fonts:
         try:
             # More robust fallback finding sans-serif
@@ -120,14 +334,17 @@ def get_random_font(font_paths, exclude_list=None):
     return random.choice(available_fonts)
 
 # Fallback random text generator
+_RNG = np.random.default_rng()
+_CHAR_ARR = np.frombuffer(FALLBACK_CHAR_SET.replace(" ", "").encode('ascii'), dtype=np.uint8)
+
 def generate_random_words(num_words):
     """Generates a string of random 'words' using only FALLBACK_CHAR_SET."""
-    words = []
-    for _ in range(num_words):
-        length = random.randint(3, 8)
-        word = ''.join(random.choice(FALLBACK_CHAR_SET.replace(" ", "")) for i in range(length))
-        words.append(word)
-    return " ".join(words)
+    # Draw every word length and character in two vectorized calls, then slice
+    lengths = _RNG.integers(3, 9, size=num_words)  # 3-8 characters per word
+    codes = _RNG.choice(_CHAR_ARR, size=int(lengths.sum())).tobytes()
+    ends = np.cumsum(lengths).tolist()
+    starts = [0] + ends[:-1]
+    return " ".join(codes[a:b].decode('ascii') for a, b in zip(starts, ends))
 
 def generate_random_text_snippet(highlighted_text, min_lines, max_lines):
     """Generates multiple lines of random text, ensuring MIN_LINES."""
@@ -152,11 +369,10 @@ def generate_random_text_snippet(highlighted_text, min_lines, max_lines):
 
     return lines, highlight_line_index
 
-# Mistral AI Text Generation Function
-def generate_ai_text_snippet(client, model, highlighted_text, min_lines, max_lines):
-    """Generates a text snippet using Mistral AI containing the highlighted text."""
+def _build_snippet_prompt(highlighted_text, min_lines, max_lines):
+    """Builds the prompt asking an AI model for lines of text around the highlighted phrase."""
     target_lines = random.randint(min_lines, max_lines)
-    prompt = (
+    return (
         f"Generate a text block of approximately {target_lines} distinct lines (aim for at least {min_lines}). "
         f"One of the lines MUST contain the exact phrase: '{highlighted_text}'. "
         f"The surrounding text should be thematically related to '{highlighted_text}' (e.g., fantasy, power, dragons, leadership). "
@@ -165,143 +381,159 @@ def generate_ai_text_snippet(client, model, highlighted_text, min_lines, max_lin
         # f"Example line containing the phrase: '...they bowed before the {highlighted_text}, their new queen...'"
     )
 
-    try:
-        messages = [UserMessage(content=prompt)]
-        chat_response = client.chat.complete(model=model, messages=messages,
-                                             temperature=0.5, max_tokens=300)
-        content = chat_response.choices[0].message.content.strip()
-
-        # Basic cleanup: remove potential empty lines
-        lines = [line for line in content.split('\n') if line.strip()]
-
-        # --- CRITICAL CHECK: Ensure minimum lines ---
-        if len(lines) < min_lines:
-            print(
-                f"Warning: AI returned only {len(lines)} valid lines (minimum requested: {min_lines}). Retrying generation.")
-            return None, -1  # Indicate failure due to insufficient lines
-
-        # Find the highlight line
-        highlight_line_index = -1
-        for i, line in enumerate(lines):
-            if highlighted_text in line:
-                highlight_line_index = i
-                break
-
-        if highlight_line_index == -1:
-            print(f"Warning: AI response did not contain the exact phrase '{highlighted_text}'.")
-            # Optionally try to insert it into a random line? Or just fail.
-            # Let's fail for now to ensure the highlight is always from AI context
-            return None, -1  # Indicate failure
-
-        return lines, highlight_line_index
-    except Exception as e:
-        print(f"An unexpected error occurred during AI text generation: {e}")
-        return None, -1  # Indicate failure
+def _parse_snippet_response(content, highlighted_text, min_lines, provider_name):
+    """Splits an AI response into lines and finds the highlight line. Returns (None, -1) if invalid."""
+    # Basic cleanup: remove potential empty lines
+    lines = [line for line in content.strip().split('\n') if line.strip()]
+
+    # --- CRITICAL CHECK: Ensure minimum lines ---
+    if len(lines) < min_lines:
+        print(f"Warning: {provider_name} returned only {len(lines)} valid lines (minimum requested: {min_lines}).")
+        return None, -1  # Indicate failure due to insufficient lines
+
+    # Find the highlight line
+    for i, line in enumerate(lines):
+        if highlighted_text in line:
+            return lines, i
+
+    # Fail rather than inserting it, to ensure the highlight is always from AI context
+    print(f"Warning: {provider_name} response did not contain the exact phrase '{highlighted_text}'.")
+    return None, -1  # Indicate failure
+
+def _is_rate_limit_error(e):
+    """True if an AI client exception is an HTTP 429 (rate limit / quota exhausted)."""
+    status = getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    return status == 429 or type(e).__name__ in ('RateLimitError', 'ResourceExhausted', 'TooManyRequests')
+
+async def _request_snippet_text(provider, prompt, mistral_client=None, mistral_model=None):
+    """Sends the prompt to the given provider and returns the raw response text."""
+    if provider == 'gemini':
+        response = await genai.GenerativeModel(GEMINI_MODEL).generate_content_async(prompt)
+        return response.text
+    chat_response = await mistral_client.chat.complete_async(model=mistral_model,
+                                                             messages=[UserMessage(content=prompt)],
+                                                             temperature=0.5, max_tokens=300)
+    return chat_response.choices[0].message.content
+
+async def _generate_via(provider, highlighted_text, min_lines, max_lines, mistral_client=None, mistral_model=None):
+    """Generates one snippet with 'mistral' or 'gemini'. Returns (lines, index), or (None, -1) on failure.
+
+    Only rate-limit errors are retried (with exponential backoff); other failures return at once.
+    """
+    provider_name = "Gemini" if provider == 'gemini' else "Mistral AI"
+    prompt = _build_snippet_prompt(highlighted_text, min_lines, max_lines)
+    for attempt in range(AI_RATE_LIMIT_RETRIES + 1):
+        try:
+            content = await _request_snippet_text(provider, prompt, mistral_client, mistral_model)
+            return _parse_snippet_response(content, highlighted_text, min_lines, provider_name)
+        except Exception as e:
+            if _is_rate_limit_error(e) and attempt < AI_RATE_LIMIT_RETRIES:
+                print(f"Warning: {provider_name} rate limit hit, retrying in {2 ** attempt}s...")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            print(f"An unexpected error occurred during {provider_name} text generation: {e}")
+            return None, -1
+    return None, -1
+
+# Mistral AI Text Generation Function
+def generate_ai_text_snippet(client, model, highlighted_text, min_lines, max_lines):
+    """Generates a text snippet using Mistral AI containing the highlighted text."""
+    return asyncio.run(_generate_via('mistral', highlighted_text, min_lines, max_lines, client, model))
 
 # Gemini AI Text Generation Function
 def generate_gemini_text_snippet(highlighted_text, min_lines, max_lines):
     """Generates a text snippet using Gemini AI containing the highlighted text."""
     if not GEMINI_AVAILABLE:
         return None, -1
-    target_lines = random.randint(min_lines, max_lines)
-    prompt = (
-        f"Generate a text block of approximately {target_lines} distinct lines (at least {min_lines}). "
-        f"One of the lines MUST contain the exact phrase: '{highlighted_text}'. "
-        f"The surrounding text should be thematically related to '{highlighted_text}' (e.g., fantasy, power, dragons, leadership). "
-        f"Ensure the phrase '{highlighted_text}' fits naturally within its line. "
-        f"Format the output ONLY as the text lines, each separated by a single newline character. Do not add any extra explanations or formatting."
-    )
-    try:
-        # Use Gemini 2.5 Flash model
-        model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
-        response = model.generate_content(prompt)
-        content = response.text.strip()
-        lines = [line for line in content.split('\n') if line.strip()]
-        if len(lines) < min_lines:
-            print(f"Warning: Gemini returned only {len(lines)} valid lines (minimum requested: {min_lines}). Retrying generation.")
-            return None, -1
-        highlight_line_index = -1
-        for i, line in enumerate(lines):
-            if highlighted_text in line:
-                highlight_line_index = i
-                break
-        if highlight_line_index == -1:
-            print(f"Warning: Gemini response did not contain the exact phrase '{highlighted_text}'.")
-            return None, -1
-        return lines, highlight_line_index
-    except Exception as e:
-        print(f"An unexpected error occurred during Gemini text generation: {e}")
-        return None, -1
-
-def create_radial_blur_mask(width, height, center_x, center_y, sharp_radius, fade_radius):
-    """Creates a grayscale mask for radial blur (sharp center, fades out)."""
-    mask = Image.new('L', (width, height), 0)
-    draw = ImageDraw.Draw(mask)
-    draw.ellipse(
-        (center_x - sharp_radius, center_y - sharp_radius,
-         center_x + sharp_radius, center_y + sharp_radius),
-        fill=255
-    )
-    # Gaussian blur the sharp circle mask for a smooth falloff
-    # Ensure fade radius is larger than sharp radius
-    blur_amount = max(0.1, (fade_radius - sharp_radius) / 3.5)  # Adjusted divisor for smoothness
-    mask = mask.filter(ImageFilter.GaussianBlur(radius=blur_amount))
+    return asyncio.run(_generate_via('gemini', highlighted_text, min_lines, max_lines))
+
+async def _gen_many_async(provider, count, highlighted_text, min_lines, max_lines, mistral_client=None, mistral_model=None):
+    """Issues `count` snippet requests concurrently and returns their (lines, index) results."""
+    return await asyncio.gather(*[
+        _generate_via(provider, highlighted_text, min_lines, max_lines, mistral_client, mistral_model)
+        for _ in range(count)
+    ])
+
+_ai_snippet_cache = OrderedDict() # key -> tuple of (lines, highlight_index), least recently used first
+_ai_snippet_cache_lock = threading.Lock() # Generation jobs run on several threads
+_ai_disk_cache = None
+
+def _get_ai_disk_cache():
+    """Opens the diskcache store on first use (None if diskcache is not installed)."""
+    global _ai_disk_cache
+    if _ai_disk_cache is None and DISKCACHE_AVAILABLE:
+        _ai_disk_cache = diskcache.Cache(AI_CACHE_DIR)
+    return _ai_disk_cache
+
+def _ai_suggest(provider, highlighted_text, count, min_lines, max_lines, mistral_client=None, mistral_model=None):
+    """Returns up to `count` valid AI snippets as a tuple of (lines, highlight_index).
+
+    All requests for a video go out in one concurrent batch, and a complete set is memoized
+    per (provider, model, text, line range), in memory and on disk if diskcache is installed,
+    so repeat requests for the same phrase make no network calls.
+    """
+    model = GEMINI_MODEL if provider == 'gemini' else mistral_model
+    key = (provider, model, highlighted_text, count, min_lines, max_lines)
+    with _ai_snippet_cache_lock:
+        cached = _ai_snippet_cache.get(key)
+        if cached is not None:
+            _ai_snippet_cache.move_to_end(key)
+            return cached
+    disk_cache = _get_ai_disk_cache()
+    cached = disk_cache.get(key) if disk_cache is not None else None
+
+    if cached is None:
+        # Requests are independent, so fire them all at once; overcommitting by 2x absorbs
+        # invalid responses without a second round trip.
+        request_count = count * 2
+        print(f"  Requesting {request_count} {provider} snippets concurrently...")
+        results = asyncio.run(_gen_many_async(provider, request_count, highlighted_text, min_lines, max_lines,
+                                              mistral_client, mistral_model))
+        valid = tuple((tuple(lines), hl_index) for lines, hl_index in results if lines and hl_index != -1)[:count]
+        if len(valid) < count:
+            return valid # Incomplete sets are not memoized, so a transient failure is retried next time
+        cached = valid
+        if disk_cache is not None:
+            disk_cache.set(key, cached, expire=AI_CACHE_TTL_SECONDS)
+    else:
+        print(f"  Using {len(cached)} cached {provider} snippets.")
+
+    with _ai_snippet_cache_lock:
+        _ai_snippet_cache[key] = cached
+        if len(_ai_snippet_cache) > AI_CACHE_MAX_ENTRIES:
+            _ai_snippet_cache.popitem(last=False)
+    return cached
+
+@lru_cache(maxsize=16)
+def get_radial_blur_mask(width, height, radial_sharp_radius_factor):
+    """Returns the centered radial blur mask (HxW uint8, 255 = sharp) for a frame size, built once."""
+    sharp_center_radius = min(width, height) * radial_sharp_radius_factor
+    fade_radius = sharp_center_radius + max(width, height) * 0.15
+    mask = build_radial_mask(width, height, width / 2, height / 2, sharp_center_radius, fade_radius)
+    mask.flags.writeable = False # Shared by every frame through the cache
     return mask
 
 
-def create_text_image_frame(width, height, text_lines, highlight_line_index, highlighted_text,
-                            font_path, font_size, text_color, bg_color, highlight_color,
-                            blur_type, blur_radius, radial_sharp_radius_factor, vertical_spread_factor):
-    """Creates a single frame image with centered highlight and multi-line text."""
-
-    # --- Font Loading ---
-    try:
-        font = ImageFont.truetype(font_path, font_size)
-        bold_font = font  # Start with regular as fallback
-        # Simple bold variant check (can be improved)
-        common_bold_suffixes = ["bd.ttf", "-Bold.ttf", "b.ttf", "_Bold.ttf", " Bold.ttf"]
-        base_name, ext = os.path.splitext(font_path)
-        for suffix in common_bold_suffixes:
-            potential_bold_path = base_name.replace("Regular", "").replace("regular",
-                                                                           "") + suffix  # Try removing 'Regular' too
-            if os.path.exists(potential_bold_path):
-                try:
-                    bold_font = ImageFont.truetype(potential_bold_path, font_size)
-                    # print(f"    Using bold variant: {os.path.basename(potential_bold_path)}") # Debug
-                    break  # Use the first one found
-                except IOError:
-                    continue  # Try next suffix if loading fails
-            # Check without removing Regular if first checks failed
-            potential_bold_path = base_name + suffix
-            if os.path.exists(potential_bold_path):
-                try:
-                    bold_font = ImageFont.truetype(potential_bold_path, font_size)
-                    # print(f"    Using bold variant: {os.path.basename(potential_bold_path)}") # Debug
-                    break
-                except IOError:
-                    continue
+# Text layout, cached by (snippet_id, font_path, font_size, width, height)
+FrameLayout = namedtuple('FrameLayout', ['base_lines', 'sharp_lines', 'highlight_x', 'highlight_y',
+                                         'highlight_width', 'highlight_height'])
+_layout_cache = {}
+_LAYOUT_CACHE_MAX_ENTRIES = 1024
 
-    except IOError as e:
-        raise FontLoadError(f"Failed to load font: {font_path}") from e
-    except Exception as e:  # Catch other potential font loading issues
-        raise FontLoadError(f"Unexpected error loading font {font_path}: {e}") from e
-
-    # --- Calculations ---
+def _compute_layout(width, height, text_lines, highlight_line_index, highlighted_text,
+                    bundle, font_size, vertical_spread_factor):
+    """Measures the text once and returns every draw position for a frame."""
+    font = bundle.font
     try:
-        # Line height using getmetrics()
-        try:
-             ascent, descent = font.getmetrics()
-             metric_height = ascent + abs(descent)
-             line_height = int(metric_height * vertical_spread_factor)
-        except AttributeError:
-             bbox_line_test = font.getbbox("Ay", anchor="lt")
-             line_height = int((bbox_line_test[3] - bbox_line_test[1]) * vertical_spread_factor)
+        # Line height using the cached getmetrics() values
+        metric_height = bundle.ascent + abs(bundle.descent)
+        line_height = int(metric_height * vertical_spread_factor)
         if line_height <= font_size * 0.8:
             line_height = int(font_size * 1.2 * vertical_spread_factor)
 
         # BOLD font metrics for final highlight placement
-        highlight_width_bold = bold_font.getlength(highlighted_text)
-        highlight_bbox_h = bold_font.getbbox(highlighted_text, anchor="lt")
+        highlight_width_bold = bundle.highlight_width_bold
+        highlight_bbox_h = bundle.highlight_bbox_h
         highlight_height_bold = highlight_bbox_h[3] - highlight_bbox_h[1]
         if highlight_width_bold <= 0 or highlight_height_bold <= 0:
              highlight_height_bold = int(font_size * 1.1)
@@ -333,111 +565,150 @@ def create_text_image_frame(width, height, text_lines, highlight_line_index, hig
         # This is the coordinate used for drawing the *full string* in the background
         bg_highlight_line_start_x = highlight_target_x - prefix_width_regular
 
-    except AttributeError: raise FontDrawError(f"Font lacks methods.")
-    except Exception as e: raise FontDrawError(f"Measurement fail: {e}") from e
-
-    # --- Base Image Drawing (Draw FULL lines, use offset for HL line) ---
-    # Render onto img_base normally first
-    img_base = Image.new('RGB', (width, height), color=bg_color)
-    draw_base = ImageDraw.Draw(img_base)
-    try:
+        base_lines = []
+        sharp_lines = []
         current_y = block_start_y
         for i, line in enumerate(text_lines):
-            line_x = 0.0
             if i == highlight_line_index and highlight_found_in_line:
-                line_x = bg_highlight_line_start_x
+                base_lines.append(((bg_highlight_line_start_x, current_y), line))
+                # Sharp layer: prefix, highlight and suffix placed around the *final* centered highlight
+                highlight_width_regular = font.getlength(highlighted_text) # Width in regular font
+                sharp_lines.append(((highlight_target_x - prefix_width_regular, current_y), prefix_text))
+                sharp_lines.append(((highlight_target_x, current_y), highlighted_text))
+                sharp_lines.append(((highlight_target_x + highlight_width_regular, current_y), suffix_text))
             else:
-                line_width = font.getlength(line)
-                line_x = (width - line_width) / 2
-            draw_base.text((line_x, current_y), line, font=font, fill=text_color, anchor="lt")
+                # Non-highlight lines are centered normally
+                line_x = (width - font.getlength(line)) / 2
+                base_lines.append(((line_x, current_y), line))
+                sharp_lines.append(((line_x, current_y), line))
             current_y += line_height
-    except Exception as e: raise FontDrawError(f"Base draw fail: {e}") from e
 
-    # --- Apply Blur (with padding for Gaussian to avoid edge clipping) ---
-    img_blurred = None # Initialize
-    padding_for_blur = int(blur_radius * 3) # Padding based on blur radius
+    except AttributeError: raise FontDrawError(f"Font lacks methods.")
+    except Exception as e: raise FontDrawError(f"Measurement fail: {e}") from e
 
-    if blur_type == 'gaussian' and blur_radius > 0:
-        try:
-            # Create larger canvas
-            padded_width = width + 2 * padding_for_blur
-            padded_height = height + 2 * padding_for_blur
-            img_padded = Image.new('RGB', (padded_width, padded_height), color=bg_color)
-            # Paste original centered onto padded canvas
-            img_padded.paste(img_base, (padding_for_blur, padding_for_blur))
-            # Blur the padded image
-            img_padded_blurred = img_padded.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            # Crop the center back to original size
-            img_blurred = img_padded_blurred.crop((padding_for_blur, padding_for_blur,
-                                                  padding_for_blur + width, padding_for_blur + height))
-        except Exception as e:
-            print(f"Error during padded Gaussian blur: {e}. Falling back to direct blur.")
-            img_blurred = img_base.filter(ImageFilter.GaussianBlur(radius=blur_radius)) # Fallback
+    return FrameLayout(tuple(base_lines), tuple(sharp_lines), highlight_target_x, highlight_target_y,
+                       highlight_width_bold, highlight_height_bold)
+
+
+@lru_cache(maxsize=512)
+def _render_highlight_tile(font_path, font_size, highlighted_text, text_rgb, highlight_rgb,
+                           x, y, width, height):
+    """Rasterizes the highlight rectangle and its bold text once.
+
+    Returns (tile, mask, (left, top)); pasting the RGB tile at (left, top) through the 'L'
+    mask gives the same pixels as drawing the rectangle and text on the frame directly.
+    """
+    bold_font = _load_font_bundle(font_path, font_size, highlighted_text).bold_font
+    padding = font_size * 0.10
+    margin = font_size # Room for glyphs that overhang the rectangle
+    left, top = math.floor(x - padding) - margin, math.floor(y - padding) - margin
+    size = (math.ceil(width + 2 * padding) + 2 * margin + 2, math.ceil(height + 2 * padding) + 2 * margin + 2)
+    # Same float coordinates as on the frame, shifted by whole pixels so rounding is unchanged
+    rect = [(x - padding - left, y - padding - top),
+            (x + width + padding - left, y + height + padding - top)]
+    text_pos = (x - left, y - top)
+
+    tile = Image.new('RGB', size, color=text_rgb)
+    draw_tile = ImageDraw.Draw(tile)
+    draw_tile.rectangle(rect, fill=highlight_rgb)
+    draw_tile.text(text_pos, highlighted_text, font=bold_font, fill=text_rgb, anchor="lt")
+    mask = Image.new('L', size, color=0)
+    draw_mask = ImageDraw.Draw(mask)
+    draw_mask.rectangle(rect, fill=255)
+    draw_mask.text(text_pos, highlighted_text, font=bold_font, fill=255, anchor="lt")
+
+    bbox = mask.getbbox() # Trim the unused margin
+    if bbox is None:
+        bbox = (0, 0, 1, 1)
+    return tile.crop(bbox), mask.crop(bbox), (left + bbox[0], top + bbox[1])
 
 
-    elif blur_type == 'radial' and blur_radius > 0:
-        # For radial, we need img_sharp. Let's try drawing it *in parts* for reliability
-        # as the padded blur trick doesn't apply directly here.
-        img_sharp = Image.new('RGB', (width, height), color=bg_color)
+def create_text_image_frame(width, height, text_lines, highlight_line_index, highlighted_text,
+                            font_path, font_size, text_rgb, bg_rgb, highlight_rgb,
+                            blur_type, blur_radius, radial_sharp_radius_factor, vertical_spread_factor,
+                            radial_mask=None, snippet_id=None):
+    """Creates a single frame image with centered highlight and multi-line text.
+
+    Colors are (r, g, b) tuples already resolved by `ImageColor.getrgb`.
+    `radial_mask` is the precomputed mask array for the 'radial' blur; it is looked up if omitted.
+    If `snippet_id` is given, the text layout is cached for that snippet/font/size.
+    The returned image is a per-process canvas that the next call draws over; copy or
+    serialize it (e.g. tobytes()) before rendering another frame.
+    """
+
+    # --- Font Loading (cached per font/size/highlight) ---
+    try:
+        bundle = _load_font_bundle(font_path, font_size, highlighted_text)
+        font = bundle.font
+    except IOError as e:
+        raise FontLoadError(f"Failed to load font: {font_path}") from e
+    except Exception as e:  # Catch other potential font loading issues
+        raise FontLoadError(f"Unexpected error loading font {font_path}: {e}") from e
+
+    # --- Layout (cached per snippet/font/size) ---
+    layout_key = (snippet_id, font_path, font_size, width, height)
+    layout = _layout_cache.get(layout_key) if snippet_id is not None else None
+    if layout is None:
+        layout = _compute_layout(width, height, text_lines, highlight_line_index, highlighted_text,
+                                 bundle, font_size, vertical_spread_factor)
+        if snippet_id is not None:
+            if len(_layout_cache) >= _LAYOUT_CACHE_MAX_ENTRIES:
+                _layout_cache.clear()
+            _layout_cache[layout_key] = layout
+    highlight_target_x = layout.highlight_x
+    highlight_target_y = layout.highlight_y
+    highlight_width_bold = layout.highlight_width
+    highlight_height_bold = layout.highlight_height
+
+    if blur_type == 'radial' and blur_radius > 0:
+        # --- Radial: draw the text once (in parts) and derive the blurred layer from it ---
+        # The mask puts the sharp pixels back in the center, so the outer blurred
+        # region does not need a separately drawn base layer.
+        img_sharp = _get_canvas('sharp', (width, height), bg_rgb)
         draw_sharp = ImageDraw.Draw(img_sharp)
         try:
-            current_y = block_start_y
-            for i, line in enumerate(text_lines):
-                if i == highlight_line_index and highlight_found_in_line:
-                    # --- Draw Sharp Highlight Line in Parts ---
-                    # Calculate positions relative to the *final* centered highlight target
-                    prefix_x = highlight_target_x - prefix_width_regular
-                    # Use REGULAR font for the sharp layer (it's just for the mask)
-                    draw_sharp.text((prefix_x, current_y), prefix_text, font=font, fill=text_color, anchor="lt")
-                    # Highlight part itself starts at highlight_target_x
-                    highlight_width_regular = font.getlength(highlighted_text) # Width in regular font
-                    draw_sharp.text((highlight_target_x, current_y), highlighted_text, font=font, fill=text_color, anchor="lt")
-                    # Suffix starts after the regular highlight width
-                    suffix_x = highlight_target_x + highlight_width_regular
-                    draw_sharp.text((suffix_x, current_y), suffix_text, font=font, fill=text_color, anchor="lt")
-                else:
-                    # Draw non-highlight lines centered normally
-                    line_width = font.getlength(line)
-                    line_x = (width - line_width) / 2
-                    draw_sharp.text((line_x, current_y), line, font=font, fill=text_color, anchor="lt")
-                current_y += line_height
+            # Highlight line is drawn in parts (prefix, highlight, suffix) using the REGULAR font
+            for pos, line in layout.sharp_lines:
+                draw_sharp.text(pos, line, font=font, fill=text_rgb, anchor="lt")
         except Exception as e:
              raise FontDrawError(f"Failed sharp text draw (parts): {e}") from e
 
-        # Composite blurred base and sharp center
-        # Base image (img_base) still uses the offset drawing method for full line
-        img_fully_blurred = img_base.filter(ImageFilter.GaussianBlur(radius=blur_radius * 1.5))
-        sharp_center_radius = min(width, height) * radial_sharp_radius_factor
-        fade_radius = sharp_center_radius + max(width, height) * 0.15
-        mask = create_radial_blur_mask(width, height, width / 2, height / 2, sharp_center_radius, fade_radius)
-        img_blurred = Image.composite(img_sharp, img_fully_blurred, mask)
+        # Composite blurred copy and sharp center
+        sharp_arr = np.asarray(img_sharp)
+        fully_blurred = gaussian_blur_u8(sharp_arr, blur_radius * 1.5)
+        if radial_mask is None:
+            radial_mask = get_radial_blur_mask(width, height, radial_sharp_radius_factor)
+        composited = scratch_buffer('composite', sharp_arr.shape)
+        composite_u8(sharp_arr, fully_blurred, radial_mask, composited)
+        img_blurred = _get_canvas('frame', (width, height))
+        img_blurred.frombytes(composited) # Copy into the reused frame canvas, no new Image
+
+    else:
+        # --- Base Image Drawing (Draw FULL lines, use offset for HL line) ---
+        img_base = _get_canvas('base', (width, height), bg_rgb)
+        draw_base = ImageDraw.Draw(img_base)
+        try:
+            for pos, line in layout.base_lines:
+                draw_base.text(pos, line, font=font, fill=text_rgb, anchor="lt")
+        except Exception as e: raise FontDrawError(f"Base draw fail: {e}") from e
 
-    else: # No blur
-        img_blurred = img_base.copy()
+        # --- Apply Blur (box-blur approximation, edge-replicated borders need no padding) ---
+        if blur_type == 'gaussian' and blur_radius > 0:
+            img_blurred = _get_canvas('frame', (width, height))
+            img_blurred.frombytes(gaussian_blur_u8(np.asarray(img_base), blur_radius))
+        else: # No blur: the highlight is drawn straight onto the base canvas
+            img_blurred = img_base
 
 
     # --- Final Image: Draw ONLY Highlight Rectangle & Centered BOLD Text ---
     final_img = img_blurred # Start with the blurred/composited image
-    draw_final = ImageDraw.Draw(final_img)
     try:
-        # 1. Draw highlight rectangle (centered using bold metrics)
-        padding = font_size * 0.10
-        draw_final.rectangle(
-            [
-                (highlight_target_x - padding, highlight_target_y - padding),
-                (highlight_target_x + highlight_width_bold + padding, highlight_target_y + highlight_height_bold + padding)
-            ],
-            fill=highlight_color
-        )
-
-        # 2. Draw ONLY the SHARP highlight text using BOLD font at the *perfectly centered* position
-        draw_final.text(
-            (highlight_target_x, highlight_target_y),
-            highlighted_text,
-            font=bold_font, # Use BOLD font
-            fill=text_color,
-            anchor="lt"
-        )
+        # Highlight rectangle + centered BOLD text, rasterized once per font/size/colors
+        # (padding of 10% of the font size around the bold metrics)
+        tile, tile_mask, tile_pos = _render_highlight_tile(
+            font_path, font_size, highlighted_text, text_rgb, highlight_rgb,
+            highlight_target_x, highlight_target_y, highlight_width_bold, highlight_height_bold)
+        final_img.paste(tile, tile_pos, tile_mask)
         # *** No prefix/suffix drawing here ***
 
     except Exception as e:
@@ -446,9 +717,280 @@ def create_text_image_frame(width, height, text_lines, highlight_line_index, hig
     return final_img
 
 
+# --- Snippet Pool ---
+# Structure-of-arrays form of the snippet pool: every line of every snippet in one flat
+# tuple, with int32 offset/highlight arrays. It is what the render workers receive.
+SnippetSOA = namedtuple('SnippetSOA', ['ids', 'lines', 'line_offsets', 'highlight_indices'])
+
+
+def flatten_snippets(pool):
+    """Converts a list of {"id", "lines", "highlight_index"} snippet dicts into a SnippetSOA."""
+    line_counts = np.fromiter((len(s["lines"]) for s in pool), dtype=np.int32, count=len(pool))
+    line_offsets = np.zeros(len(pool) + 1, dtype=np.int32)
+    np.cumsum(line_counts, out=line_offsets[1:])
+    return SnippetSOA(
+        ids=np.fromiter((s["id"] for s in pool), dtype=np.int64, count=len(pool)),
+        lines=tuple(line for s in pool for line in s["lines"]),
+        line_offsets=line_offsets,
+        highlight_indices=np.fromiter((s["highlight_index"] for s in pool), dtype=np.int32, count=len(pool)),
+    )
+
+
+def snippet_lines(soa, index):
+    """Returns the lines of snippet `index` as a tuple (a slice of the flat line tuple)."""
+    return soa.lines[soa.line_offsets[index]:soa.line_offsets[index + 1]]
+
+
+# --- Parallel Frame Rendering ---
+def _available_cpus():
+    """CPUs this process may actually use: its affinity mask, further capped by a cgroup v2
+    CPU quota (Docker --cpus, Kubernetes limits), which os.cpu_count() ignores."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass # No cgroup v2 quota
+    return max(1, cpus)
+
+
+def _render_pool_context():
+    """Multiprocessing context for the render pool.
+
+    Workers must not be plain forks of the web process: they would inherit the write end of
+    every open ffmpeg stdin pipe, so ffmpeg would never see EOF when the parent closes it.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+_WORKER_SNIPPETS = None # SnippetSOA of the current video, set by the pool initializer
+
+def _init_render_worker(snippets, font_paths, font_size, cfg, bold_map):
+    """Process pool initializer: receives the snippet pool, then parses every candidate font
+    and builds the radial mask once per worker."""
+    global _WORKER_SNIPPETS
+    _WORKER_SNIPPETS = snippets
+    _BOLD_MAP.update(bold_map)
+    for font_path in font_paths:
+        try:
+            _load_font(font_path, font_size)
+        except Exception:
+            pass # Broken fonts are reported (and excluded) by the frame that picks them
+    # Split the CPUs between the workers instead of every worker's kernels using all of them
+    set_kernel_threads(cfg['kernel_threads'])
+    warmup_kernels()
+    if cfg['blur_type'] == 'radial' and cfg['blur_radius'] > 0:
+        get_radial_blur_mask(cfg['width'], cfg['height'], cfg['radial_sharp_radius_factor'])
+
+
+def _render_one_frame(job, font_paths, failed_fonts, cfg):
+    """Renders one frame in a worker process.
+
+    `job` is the planned (snippet_index, font_path) into the worker's snippet pool; other
+    fonts are tried if that font fails. Returns (frame_bytes, failed_fonts, error);
+    frame_bytes is None on error.
+    """
+    snippet_index, current_font_path = job
+    failed_fonts = set(failed_fonts)
+    available_fonts = None # font_paths minus failed_fonts, rebuilt only after a font fails
+    snippets = _WORKER_SNIPPETS
+    current_lines = snippet_lines(snippets, snippet_index)
+    highlight_idx = int(snippets.highlight_indices[snippet_index])
+    snippet_id = int(snippets.ids[snippet_index])
+    radial_mask = None
+    if cfg['blur_type'] == 'radial' and cfg['blur_radius'] > 0:
+        radial_mask = get_radial_blur_mask(cfg['width'], cfg['height'], cfg['radial_sharp_radius_factor'])
+
+    font_retries = 0
+    while font_retries < MAX_FONT_RETRIES_PER_FRAME:
+        if current_font_path is None or current_font_path in failed_fonts:
+            if available_fonts is None:
+                available_fonts = tuple(p for p in font_paths if p not in failed_fonts)
+            current_font_path = get_random_font(available_fonts)
+        if current_font_path is None:
+            # This now returns None only if EVERYTHING fails, including fallback
+            return None, failed_fonts, "No usable fonts available after multiple attempts."
+
+        try:
+            img = create_text_image_frame(
+                cfg['width'], cfg['height'],
+                current_lines, highlight_idx, cfg['highlighted_text'],
+                current_font_path, cfg['font_size'],
+                cfg['text_rgb'], cfg['bg_rgb'], cfg['highlight_rgb'],
+                cfg['blur_type'], cfg['blur_radius'], cfg['radial_sharp_radius_factor'],
+                cfg['vertical_spread_factor'],
+                radial_mask=radial_mask, snippet_id=snippet_id
+            )
+            if img.mode != 'RGB':
+                img = img.convert('RGB') # ffmpeg reads rgb24; any other mode would shear the video
+            return img.tobytes(), failed_fonts, None # Raw RGB24, ready for the encoder
+
+        except (FontLoadError, FontDrawError) as e:
+            print(f"    Warning: Font '{os.path.basename(current_font_path)}' failed. ({e}). Retrying with another font.")
+            failed_fonts.add(current_font_path)
+            _forget_font(current_font_path)
+            available_fonts = None
+            font_retries += 1
+            # Check if we've run out of fonts to try for this frame
+            if len(failed_fonts) >= len(font_paths):
+                 print("    ERROR: All available fonts failed. Trying system fallback once more.")
+                 # Try the matplotlib fallback directly if list exhausted
+                 fallback_font = get_random_font([], exclude_list=failed_fonts) # Trigger fallback explicitly
+                 if fallback_font and fallback_font not in failed_fonts:
+                      failed_fonts.add(fallback_font) # Add it so we don't retry infinitely
+                      font_retries = 0 # Reset retries for the fallback font
+                      print(f"    Attempting frame with fallback font: {fallback_font}")
+                      continue # Re-enter the loop to try drawing with fallback
+                 else:
+                      print("    ERROR: Even fallback font failed or wasn't found.")
+                      break # Break font retry loop for this frame
+
+        except Exception as e:
+            print(f"    ERROR: Unexpected error generating frame with font {os.path.basename(current_font_path)}: {e}")
+            traceback.print_exc() # Log full error
+            failed_fonts.add(current_font_path)
+            _forget_font(current_font_path)
+            available_fonts = None
+            font_retries += 1
+
+    return None, failed_fonts, f"Failed after {MAX_FONT_RETRIES_PER_FRAME} font attempts. Font issues likely. Check font compatibility."
+
+
+# --- Video Encoding ---
+class FFmpegWriter:
+    """Streams raw RGB frames into an ffmpeg subprocess that encodes them to H.264.
+
+    Frames pass through a bounded queue to a writer thread, so the caller keeps collecting
+    rendered frames while ffmpeg consumes the previous ones.
+    """
+
+    def __init__(self, output_path, width, height, fps, ffmpeg_exe='ffmpeg', preset=X264_PRESET,
+                 queue_size=FRAME_QUEUE_SIZE, use_nvenc=False, threads=0, output_size=None):
+        if use_nvenc:
+            # GPU encode; `preset` names x264 presets, so NVENC uses its balanced p4 preset
+            codec_args = ['-c:v', 'h264_nvenc', '-preset', 'p4', '-rc', 'vbr', '-cq', '23']
+        else:
+            # CPU encode, tuned for sharp static text
+            codec_args = ['-c:v', 'libx264', '-preset', preset, '-tune', 'stillimage']
+        if output_size and tuple(output_size) != (width, height):
+            # Frames were rendered smaller than the requested video size
+            codec_args = ['-vf', f'scale={output_size[0]}:{output_size[1]}:flags=lanczos'] + codec_args
+        self.command = [
+            ffmpeg_exe, '-y', '-loglevel', 'error',
+            # Input: raw RGB24 frames on stdin
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            # Output: H.264 with broad player compatibility
+            *codec_args, '-pix_fmt', 'yuv420p', '-threads', str(threads), # 0 = encoder's own choice
+            # Put the moov atom first so browsers can start playback before the download finishes
+            '-movflags', '+faststart',
+            output_path,
+        ]
+        self.proc = None
+        self.frame_size = width * height * 3
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.write_error = None
+
+    def __enter__(self):
+        # stderr goes to a temp file, not a pipe: nobody drains it while frames are being written
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stderr=self.stderr)
+        self.thread = threading.Thread(target=self._drain, name='ffmpeg-writer', daemon=True)
+        self.thread.start()
+        return self
+
+    def _drain(self):
+        """Writer thread: feeds queued frames to ffmpeg's stdin until the None sentinel."""
+        while True:
+            frame_bytes = self.frames.get()
+            if frame_bytes is None:
+                return
+            if self.write_error is None:
+                try:
+                    self.proc.stdin.write(frame_bytes)
+                except OSError as e: # BrokenPipeError if ffmpeg died
+                    self.write_error = e # Keep draining so write() never blocks on a dead encoder
+
+    def write(self, frame_bytes):
+        """Queues one frame (raw RGB24 bytes, e.g. from Image.tobytes()) for the encoder."""
+        if len(frame_bytes) != self.frame_size:
+            # rawvideo has no frame boundaries: a short frame would shift every later one
+            raise ValueError(f"Frame is {len(frame_bytes)} bytes, expected {self.frame_size} (RGB24)")
+        if self.write_error is not None:
+            raise self.write_error
+        self.frames.put(frame_bytes) # Blocks while FRAME_QUEUE_SIZE frames are waiting
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.proc.kill() # Don't finalize a file we are going to discard
+        self.frames.put(None)
+        self.thread.join()
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.proc.wait()
+        self.stderr.seek(0)
+        stderr_text = self.stderr.read().decode('utf-8', errors='replace').strip()
+        self.stderr.close()
+        if exc_type is None and (returncode != 0 or self.write_error is not None):
+            raise RuntimeError(f"ffmpeg exited with status {returncode}: {stderr_text[-500:] or self.write_error}")
+        if exc_type is not None and stderr_text:
+            print(f"ffmpeg output:\n{stderr_text}")
+        return False
+
+
+def _map_chunk(fn, jobs):
+    """Pool task: applies fn to each job of a chunk, in order."""
+    return [fn(job) for job in jobs]
+
+
+def _bounded_map(executor, fn, jobs, chunksize, max_pending):
+    """Ordered executor.map(fn, jobs, chunksize=...) that keeps at most `max_pending` chunks
+    submitted but not yet consumed, so results cannot pile up faster than they are used."""
+    pending = deque()
+    for start in range(0, len(jobs), chunksize):
+        pending.append(executor.submit(_map_chunk, fn, jobs[start:start + chunksize]))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def _plan_frame_sources(frame_keys, max_cached):
+    """Maps each frame to the index of the frame whose render it reuses (itself if rendered).
+
+    A frame reuses an earlier render with the same (snippet, font) key while that render is
+    still among the `max_cached` most recently used ones, which bounds the frames held in memory.
+    """
+    recent = OrderedDict() # key -> index of the rendered frame
+    sources = []
+    for i, key in enumerate(frame_keys):
+        if key in recent:
+            recent.move_to_end(key)
+        else:
+            recent[key] = i
+            if len(recent) > max_cached:
+                recent.popitem(last=False)
+        sources.append(recent[key])
+    return sources
+
+
 # --- Core Video Generation Logic (Adapted from main) ---
-def generate_video(params):
-    """Generates the video based on input parameters."""
+_SNIPPET_IDS = itertools.count() # Stable ids for pooled snippets (layout cache keys)
+
+def generate_video(params, progress=None):
+    """Generates the video based on input parameters.
+
+    `progress`, if given, is called as progress(frames_done, total_frames) while encoding.
+    """
 
     # Unpack parameters from the dictionary passed by the Flask route
     width = params['width']
@@ -463,8 +1005,25 @@ def generate_video(params):
     blur_radius = params['blur_radius']
     ai_enabled = params['ai_enabled']
     ai_provider = params.get('ai_provider', 'mistral')  # 'mistral', 'gemini', or 'random'
+    x264_preset = params.get('x264_preset', X264_PRESET)
     font_dir = app.config['FONT_DIR'] # Use font dir from Flask config
 
+    # Resolve colors once; PIL would otherwise re-parse the strings on every fill
+    try:
+        text_rgb = ImageColor.getrgb(text_color)[:3]
+        bg_rgb = ImageColor.getrgb(background_color)[:3]
+        highlight_rgb = ImageColor.getrgb(highlight_color)[:3]
+    except ValueError as e:
+        return None, f"Invalid color value: {e}"
+
+    # Identical parameters map to the same file, so a re-submitted form reuses the video
+    output_filename = f"text_match_cut_{_params_key(params)}.mp4"
+    output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+    if os.path.exists(output_path):
+        os.utime(output_path) # Restart its TTL
+        print(f"Reusing existing video '{output_filename}' for identical parameters.")
+        return output_filename, None
+
     # Hardcoded or derived settings from original script
     font_size_ratio = 0.05 # Could be made a parameter
     min_lines = 7
@@ -497,20 +1056,7 @@ def generate_video(params):
             ai_enabled = False
 
     # --- Font Discovery ---
-    font_paths = []
-    if font_dir and os.path.isdir(font_dir):
-        print(f"Looking for fonts in specified directory: {font_dir}")
-        for filename in os.listdir(font_dir):
-            if filename.lower().endswith((".ttf", ".otf")):
-                font_paths.append(os.path.join(font_dir, filename))
-    else:
-        print("FONT_DIR not specified or invalid, searching system fonts...")
-        try:
-            # Limit search to common locations if possible, or search all
-            font_paths = fm.findSystemFonts(fontpaths=None, fontext='ttf')
-            # font_paths.extend(fm.findSystemFonts(fontpaths=None, fontext='otf'))
-        except Exception as e:
-            print(f"Error finding system fonts: {e}")
+    font_paths = _discover_fonts(font_dir)
 
     if not font_paths:
         print("ERROR: No fonts found in font dir or system. Cannot proceed.")
@@ -522,40 +1068,26 @@ def generate_video(params):
     text_snippets_pool = []
     print(f"Generating text snippets (AI: {ai_enabled})...")
 
+    if ai_enabled and (use_gemini or mistral_client):
+        provider = 'gemini' if use_gemini else 'mistral'
+        for lines, hl_index in _ai_suggest(provider, highlighted_text, unique_text_count, min_lines, max_lines,
+                                           mistral_client, mistral_model):
+            text_snippets_pool.append({"id": next(_SNIPPET_IDS), "lines": lines, "highlight_index": hl_index})
+        print(f"    {len(text_snippets_pool)} valid {provider} snippets received.")
+        if len(text_snippets_pool) < unique_text_count:
+            print("    Not enough valid AI snippets, filling the pool with random text.")
+
     generation_attempts = 0
     max_generation_attempts = unique_text_count * 4 # Allow more attempts
 
     while len(text_snippets_pool) < unique_text_count and generation_attempts < max_generation_attempts:
         generation_attempts += 1
-        if ai_enabled and use_gemini:
-            print(f"  Attempting Gemini generation ({generation_attempts})...")
-            lines, hl_index = generate_gemini_text_snippet(highlighted_text, min_lines, max_lines)
-            if lines is None or hl_index == -1:
-                print("    Gemini generation failed or invalid. Will retry or use random.")
-                time.sleep(0.5)
-                if generation_attempts > max_generation_attempts // 2:
-                    print("    Gemini failed repeatedly, falling back to random for this snippet.")
-                    lines, hl_index = generate_random_text_snippet(highlighted_text, min_lines, max_lines)
-            else:
-                print(f"    Gemini snippet generated ({len(lines)} lines).")
-        elif ai_enabled and mistral_client:
-            print(f"  Attempting Mistral generation ({generation_attempts})...")
-            lines, hl_index = generate_ai_text_snippet(mistral_client, mistral_model, highlighted_text, min_lines, max_lines)
-            if lines is None or hl_index == -1:
-                print("    Mistral generation failed or invalid. Will retry or use random.")
-                time.sleep(0.5)
-                if generation_attempts > max_generation_attempts // 2:
-                    print("    Mistral failed repeatedly, falling back to random for this snippet.")
-                    lines, hl_index = generate_random_text_snippet(highlighted_text, min_lines, max_lines)
-            else:
-                print(f"    Mistral snippet generated ({len(lines)} lines).")
-        else:
-            print("  Generating random text snippet...")
-            lines, hl_index = generate_random_text_snippet(highlighted_text, min_lines, max_lines)
+        print("  Generating random text snippet...")
+        lines, hl_index = generate_random_text_snippet(highlighted_text, min_lines, max_lines)
 
         # Add successfully generated snippet to pool
         if lines and hl_index != -1:
-             text_snippets_pool.append({"lines": lines, "highlight_index": hl_index})
+             text_snippets_pool.append({"id": next(_SNIPPET_IDS), "lines": lines, "highlight_index": hl_index})
 
     if not text_snippets_pool:
         print("ERROR: Failed to generate any text snippets (AI or random).")
@@ -565,142 +1097,208 @@ def generate_video(params):
 
     # --- Calculate Other Parameters ---
     total_frames = int(fps * duration_seconds)
+    # Frames are rendered at most MAX_RENDER_DIMENSION px on the longest side (rendering and
+    # blur cost grow with the pixel count) and ffmpeg upscales them to the requested size.
+    render_scale = min(1.0, MAX_RENDER_DIMENSION / max(width, height))
+    render_width, render_height = round(width * render_scale), round(height * render_scale)
+    render_blur_radius = blur_radius * render_scale
     # Calculate font size based on height dynamically
-    font_size = int(height * font_size_ratio)
+    font_size = int(render_height * font_size_ratio)
     print(f"\nVideo Settings: {width}x{height} @ {fps}fps, {duration_seconds}s ({total_frames} frames)")
+    if render_scale < 1.0:
+        print(f"Render Settings: {render_width}x{render_height}, upscaled by ffmpeg (lanczos)")
     print(f"Text Settings: Highlight='{highlighted_text}', Size={font_size}px")
     print(f"Effect Settings: BlurType='{blur_type}', BlurRadius={blur_radius}, HighlightColor='{highlight_color}'")
 
-    # --- Generate Frames ---
-    frames = []
+    # --- Generate Frames & Encode ---
+    # Frames are independent, so they are rendered in a process pool; _bounded_map
+    # yields results in submission order, and each frame is streamed to ffmpeg as soon
+    # as it arrives instead of being buffered in memory.
+    # The snippet and font of every frame are picked up front: frames sharing both are
+    # pixel-identical, so only the first one is rendered and its bytes are re-sent.
+    frame_keys = [(random.randrange(len(text_snippets_pool)), random.choice(font_paths))
+                  for _ in range(total_frames)]
+    max_cached_frames = max(1, FRAME_CACHE_MAX_BYTES // (render_width * render_height * 3))
+    frame_sources = _plan_frame_sources(frame_keys, max_cached_frames)
+    render_jobs = [frame_keys[i] for i, source in enumerate(frame_sources) if source == i]
+    last_use = {source: i for i, source in enumerate(frame_sources)}
     failed_fonts = set()
-    print("\nGenerating frames...")
-    frame_num = 0
-    while frame_num < total_frames:
-        # print(f"  Attempting Frame {frame_num + 1}/{total_frames}") # Can be verbose
-
-        # Select a text snippet and font for this frame
-        snippet = random.choice(text_snippets_pool)
-        current_lines = snippet["lines"]
-        highlight_idx = snippet["highlight_index"]
-
-        font_retries = 0
-        frame_generated = False
-        while font_retries < MAX_FONT_RETRIES_PER_FRAME:
-            current_font_path = get_random_font(font_paths, exclude_list=failed_fonts)
-            if current_font_path is None:
-                # This now returns None only if EVERYTHING fails, including fallback
-                return None, "No usable fonts available after multiple attempts."
-
-            try:
-                img = create_text_image_frame(
-                    width, height,
-                    current_lines, highlight_idx, highlighted_text,
-                    current_font_path, font_size,
-                    text_color, background_color, highlight_color,
-                    blur_type, blur_radius, radial_sharp_radius_factor,
-                    vertical_spread_factor
-                )
-
-                frame_np = np.array(img)
-                frames.append(frame_np)
-                frame_generated = True
-                # print(f"    Frame {frame_num + 1} generated with font: {os.path.basename(current_font_path)}")
-                break # Success, move to next frame attempt
-
-            except (FontLoadError, FontDrawError) as e:
-                print(f"    Warning: Font '{os.path.basename(current_font_path)}' failed for frame {frame_num + 1}. ({e}). Retrying with another font.")
-                failed_fonts.add(current_font_path)
-                font_retries += 1
-                # Check if we've run out of fonts to try for this frame
-                if len(failed_fonts) >= len(font_paths):
-                     print(f"    ERROR: All available fonts failed for frame {frame_num + 1}. Trying system fallback once more.")
-                     # Try the matplotlib fallback directly if list exhausted
-                     fallback_font = get_random_font([], exclude_list=failed_fonts) # Trigger fallback explicitly
-                     if fallback_font and fallback_font not in failed_fonts:
-                          failed_fonts.add(fallback_font) # Add it so we don't retry infinitely
-                          font_retries = 0 # Reset retries for the fallback font
-                          print(f"    Attempting frame {frame_num + 1} with fallback font: {fallback_font}")
-                          continue # Re-enter the loop to try drawing with fallback
-                     else:
-                          print(f"    ERROR: Even fallback font failed or wasn't found. Skipping frame {frame_num + 1}.")
-                          frame_generated = False # Mark as not generated
-                          break # Break font retry loop for this frame
-
-            except Exception as e:
-                print(f"    ERROR: Unexpected error generating frame {frame_num + 1} with font {os.path.basename(current_font_path)}: {e}")
-                traceback.print_exc() # Log full error
-                failed_fonts.add(current_font_path)
-                font_retries += 1
-
-        if not frame_generated:
-            print(f"ERROR: Failed to generate Frame {frame_num + 1} after {MAX_FONT_RETRIES_PER_FRAME} font attempts. Stopping video generation.")
-            # Decide whether to stop entirely or just make a shorter video
-            # For a web app, stopping might be better than returning a broken/short video.
-            return None, f"Failed to generate frame {frame_num + 1}. Font issues likely. Check font compatibility."
-            # break # Or use break to create a shorter video
-
-        frame_num += 1
-        # Add progress update for long renders
-        if frame_num % (total_frames // 10) == 0 or frame_num == total_frames: # Update every 10%
-             print(f"  Progress: {frame_num}/{total_frames} frames generated...")
-
-
-    # --- Create Video ---
-    if not frames:
-        print("ERROR: No frames were generated. Cannot create video.")
-        return None, "No frames were generated, possibly due to persistent font errors."
-
-    if len(frames) < total_frames:
-        print(f"Warning: Only {len(frames)}/{total_frames} frames were generated due to errors. Video will be shorter.")
-
-    # Generate unique filename
-    unique_id = uuid.uuid4()
-    output_filename = f"text_match_cut_{unique_id}.mp4"
-    output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-
-    print(f"\nCompiling video to {output_path}...")
+    render_cfg = {
+        'width': render_width, 'height': render_height,
+        'highlighted_text': highlighted_text, 'font_size': font_size,
+        'text_rgb': text_rgb, 'bg_rgb': bg_rgb, 'highlight_rgb': highlight_rgb,
+        'blur_type': blur_type, 'blur_radius': render_blur_radius,
+        'radial_sharp_radius_factor': radial_sharp_radius_factor,
+        'vertical_spread_factor': vertical_spread_factor,
+    }
+    render_frame = partial(_render_one_frame, font_paths=tuple(font_paths),
+                           failed_fonts=frozenset(), cfg=render_cfg)
+    available_cpus = _available_cpus()
+    render_workers = max(1, min(available_cpus, len(render_jobs)))
+    render_cfg['kernel_threads'] = max(1, available_cpus // render_workers)
+    # x264 auto-threads to every core; when the render pool is using them, cap it at what is left
+    encoder_threads = 0 if render_workers == 1 else max(2, available_cpus - render_workers)
+
+    # Encode to a private temp name and rename when complete, so the final name never
+    # refers to a partial file (and two identical jobs can't write into each other)
+    partial_path = os.path.join(app.config['UPLOAD_FOLDER'], f".{uuid.uuid4().hex}.partial.mp4")
+
+    print(f"\nGenerating {len(render_jobs)} unique frames ({render_workers} worker processes) and encoding to {output_path}...")
+    frame_error_message = None
+    # The snippet pool reaches each worker once, through the initializer, not with every chunk of jobs
+    executor = ProcessPoolExecutor(max_workers=render_workers, mp_context=_render_pool_context(),
+                                   initializer=_init_render_worker,
+                                   initargs=(flatten_snippets(text_snippets_pool), tuple(font_paths),
+                                             font_size, render_cfg, _BOLD_MAP))
     try:
-        # Ensure frames is a list of numpy arrays
-        if not isinstance(frames[0], np.ndarray):
-             frames = [np.array(f) for f in frames]
-
-        clip = ImageSequenceClip(frames, fps=fps)
-
-        # Write video file using recommended settings
-        # logger='bar' might not work well in web server logs, use None or default
-        # Specify audio=False if there's no audio track
-        # threads can speed up encoding, preset affects quality/speed balance
-        clip.write_videofile(output_path,
-                             codec='libx264', # Good compatibility
-                             preset='medium', # Balance speed/quality (ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
-                             fps=fps,
-                             threads=max(1, os.cpu_count() // 2), # Use half CPU cores
-                             logger=None, # Avoid progress bar in server logs
-                             audio=False) # Explicitly no audio
-
-        clip.close() # Release resources
-        print(f"\nVideo saved successfully as '{output_filename}'")
-
-        # Optionally list failed fonts
-        if failed_fonts:
-            print("\nFonts that caused errors during generation:")
-            for ff in sorted(list(failed_fonts)):
-                print(f" - {os.path.basename(ff)}")
-
-        return output_filename, None # Return filename on success, no error
+        with FFmpegWriter(partial_path, render_width, render_height, fps, ffmpeg_exe=FFMPEG_EXE,
+                          preset=x264_preset, use_nvenc=HAS_NVENC, threads=encoder_threads,
+                          output_size=(width, height)) as writer:
+            # ~4 chunks per worker: few enough round trips, small enough to keep the load balanced.
+            # Two chunks per worker are kept in flight, capped by RENDER_INFLIGHT_MAX_BYTES.
+            max_pending_chunks = 2 * render_workers
+            render_chunksize = max(1, min(len(render_jobs) // (4 * render_workers),
+                                          RENDER_INFLIGHT_MAX_BYTES // (max_pending_chunks * render_width * render_height * 3)))
+            frame_results = _bounded_map(executor, render_frame, render_jobs, render_chunksize, max_pending_chunks)
+            rendered_frames = {} # frame index -> bytes, kept until the last frame reusing it
+            progress_every = max(1, total_frames // 10) # Videos under 10 frames report every frame
+            for frame_num, source in enumerate(frame_sources, start=1):
+                if source == frame_num - 1:
+                    frame_bytes, frame_failed_fonts, frame_error = next(frame_results)
+                    failed_fonts.update(frame_failed_fonts)
+                    if frame_error:
+                        print(f"ERROR: Failed to generate Frame {frame_num}: {frame_error} Stopping video generation.")
+                        # For a web app, stopping might be better than returning a broken/short video.
+                        frame_error_message = f"Failed to generate frame {frame_num}. Font issues likely. Check font compatibility."
+                        break
+                    rendered_frames[source] = frame_bytes
+
+                writer.write(rendered_frames[source])
+                if last_use[source] == frame_num - 1:
+                    del rendered_frames[source]
+                if progress is not None:
+                    progress(frame_num, total_frames)
+                # Add progress update for long renders
+                if frame_num % progress_every == 0 or frame_num == total_frames: # Update every 10%
+                     print(f"  Progress: {frame_num}/{total_frames} frames generated...")
 
     except Exception as e:
         print(f"\nError during video writing: {e}")
         traceback.print_exc()
-        error_message = f"Error during video writing: {e}. Check server logs and FFmpeg installation/codec support (libx264)."
-        # Clean up potentially partially written file
-        if os.path.exists(output_path):
-            try:
-                os.remove(output_path)
-            except OSError:
-                pass # Ignore cleanup error
-        return None, error_message
+        _remove_partial_output(partial_path)
+        return None, f"Error during video writing: {e}. Check server logs and FFmpeg installation/codec support ({'h264_nvenc' if HAS_NVENC else 'libx264'})."
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if frame_error_message:
+        _remove_partial_output(partial_path)
+        return None, frame_error_message
+
+    os.replace(partial_path, output_path)
+    print(f"\nVideo saved successfully as '{output_filename}'")
+
+    # Optionally list failed fonts
+    if failed_fonts:
+        print("\nFonts that caused errors during generation:")
+        for ff in sorted(list(failed_fonts)):
+            print(f" - {os.path.basename(ff)}")
+
+    return output_filename, None # Return filename on success, no error
+
+
+def _params_key(params):
+    """Stable hash of the generation parameters, used as the output file name."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+_last_output_sweep = 0.0
+
+def _sweep_output_folder():
+    """Deletes generated videos (and stale partial files) older than OUTPUT_TTL_SECONDS.
+
+    Runs at most once per OUTPUT_SWEEP_INTERVAL_SECONDS; called when a job is queued.
+    """
+    global _last_output_sweep
+    now = time.time()
+    if now - _last_output_sweep < OUTPUT_SWEEP_INTERVAL_SECONDS:
+        return
+    _last_output_sweep = now
+    folder = app.config['UPLOAD_FOLDER']
+    for entry in os.scandir(folder):
+        if not entry.name.endswith('.mp4') or not entry.is_file():
+            continue
+        try:
+            if now - entry.stat().st_mtime > OUTPUT_TTL_SECONDS:
+                os.remove(entry.path)
+                print(f"Removed expired video '{entry.name}'.")
+        except OSError:
+            pass # Removed concurrently or in use; retried on the next sweep
+
+
+def _remove_partial_output(output_path):
+    """Cleans up a partially written video file."""
+    if os.path.exists(output_path):
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass # Ignore cleanup error
+
+
+# --- Background Generation Jobs ---
+# /generate only queues the work; the page then polls /status/<job_id> until the video is ready.
+_generation_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix='generate')
+_jobs = {} # job_id -> GenerationJob, oldest first
+_jobs_lock = threading.Lock()
+
+
+class GenerationJob:
+    """One queued video generation; updated by its worker thread, read by /status."""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.frames_done = 0
+        self.total_frames = 0
+        self.future = None
+
+    def set_progress(self, frames_done, total_frames):
+        self.frames_done, self.total_frames = frames_done, total_frames
+
+    def run(self):
+        """Worker thread entry point. Returns (filename, error) like generate_video."""
+        try:
+            return generate_video(self.params, progress=self.set_progress)
+        except Exception as e:
+            print(f"An unexpected error occurred in generation job {self.id}: {e}")
+            traceback.print_exc()
+            return None, f"An unexpected server error occurred: {e}"
+
+    def status(self):
+        """JSON-serializable state for the status endpoint."""
+        done = self.future.done()
+        filename, error = self.future.result() if done else (None, None)
+        return {
+            'done': done,
+            'error': error,
+            'filename': filename,
+            'download_url': url_for('download_file', filename=filename) if filename else None,
+            'frames_done': self.frames_done,
+            'total_frames': self.total_frames,
+        }
+
+
+def _submit_generation_job(params):
+    """Queues generate_video(params) on the background executor and returns its GenerationJob."""
+    job = GenerationJob(params)
+    with _jobs_lock:
+        _sweep_output_folder()
+        # Forget the oldest finished jobs once too many are tracked
+        finished = [jid for jid, j in _jobs.items() if j.future.done()]
+        for jid in finished[:max(0, len(_jobs) - MAX_TRACKED_JOBS + 1)]:
+            del _jobs[jid]
+        job.future = _generation_executor.submit(job.run)
+        _jobs[job.id] = job
+    return job
 
 
 # --- Flask Routes ---
@@ -732,6 +1330,7 @@ def generate():
             'blur_radius': request.form.get('blur_radius', default=4.0, type=float),
             'ai_enabled': request.form.get('ai_enabled') == 'true' and (MISTRAL_AVAILABLE or GEMINI_AVAILABLE),
             'ai_provider': ai_provider,
+            'x264_preset': request.form.get('x264_preset', default=X264_PRESET),
         }
 
         # Basic Input Validation (Example)
@@ -747,17 +1346,20 @@ def generate():
         if not (256 <= params['width'] <= 4096) or not (256 <= params['height'] <= 4096):
              flash('Width and Height must be between 256 and 4096 pixels.', 'error')
              return redirect(url_for('index'))
+        # Frames are streamed, so memory stays bounded, but the total pixel work is capped too
+        render_bytes = params['width'] * params['height'] * 3 * params['fps'] * params['duration']
+        if render_bytes > RENDER_BUDGET_BYTES:
+             flash(f"Requested parameters exceed the render budget ({render_bytes / (1 << 30):.1f} GiB of frames, "
+                   f"max {RENDER_BUDGET_BYTES / (1 << 30):.0f} GiB). Lower the resolution, FPS or duration.", 'error')
+             return redirect(url_for('index'))
+        if params['x264_preset'] not in X264_PRESETS:
+             flash(f"Encoding speed must be one of: {', '.join(X264_PRESETS)}.", 'error')
+             return redirect(url_for('index'))
 
 
-        # --- Trigger the generation ---
-        generated_filename, error = generate_video(params)
-
-        if error:
-            # Render index page again, displaying the error
-            return render_template('index.html', error=error, mistral_available=MISTRAL_AVAILABLE, gemini_available=GEMINI_AVAILABLE)
-        else:
-            # Render index page again, providing the download link
-            return render_template('index.html', filename=generated_filename, mistral_available=MISTRAL_AVAILABLE, gemini_available=GEMINI_AVAILABLE)
+        # --- Queue the generation; the page polls /status/<job_id> for the result ---
+        job = _submit_generation_job(params)
+        return render_template('index.html', job_id=job.id, mistral_available=MISTRAL_AVAILABLE, gemini_available=GEMINI_AVAILABLE)
 
     except Exception as e:
         print(f"An unexpected error occurred in /generate route: {e}")
@@ -765,12 +1367,33 @@ def generate():
         return render_template('index.html', error=f"An unexpected server error occurred: {e}", mistral_available=MISTRAL_AVAILABLE, gemini_available=GEMINI_AVAILABLE)
 
 
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    """Reports the progress of a queued generation job as JSON."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id. It may have expired.'}), 404
+    return jsonify(job.status())
+
+
 @app.route('/output/<filename>')
 def download_file(filename):
     """Serves the generated video file for download."""
     try:
-        # Security: Ensure filename is safe and only serves from the UPLOAD_FOLDER
-        return send_from_directory(app.config["UPLOAD_FOLDER"], filename, as_attachment=True)
+        if USE_XACCEL:
+            # nginx streams the file itself (sendfile, Range requests); Python only checks it exists
+            file_path = safe_join(app.config["UPLOAD_FOLDER"], filename)
+            if file_path is None or not os.path.isfile(file_path):
+                raise FileNotFoundError(filename)
+            response = app.response_class(mimetype='video/mp4')
+            response.headers['X-Accel-Redirect'] = XACCEL_PREFIX + filename
+            response.headers.set('Content-Disposition', 'attachment', filename=filename)
+            return response
+        # Security: Ensure filename is safe and only serves from the UPLOAD_FOLDER.
+        # conditional=True answers Range / If-Modified-Since requests (resumed downloads, seeking).
+        return send_from_directory(app.config["UPLOAD_FOLDER"], filename, as_attachment=True,
+                                   conditional=True, max_age=DOWNLOAD_MAX_AGE)
     except FileNotFoundError:
          flash('Error: File not found. It might have been deleted or generation failed.', 'error')
          return redirect(url_for('index'))
@@ -783,6 +1406,8 @@ def download_file(filename):
 if __name__ == '__main__':
     print(f"Mistral AI Available: {MISTRAL_AVAILABLE}")
     print(f"Gemini AI Available: {GEMINI_AVAILABLE}")
+    # Compile the pixel kernels once at boot; render workers then load them from the disk cache
+    warmup_kernels()
     # Use host='0.0.0.0' to make accessible on your network (use with caution)
     # debug=True automatically reloads on code changes, but disable for production
     app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
@@ -0,0 +1,205 @@
+import math
+
+import numpy as np
+
+# --- Numba Integration ---
+# Numba is optional: without it the same kernels run as vectorized NumPy code.
+# Kernels are compiled with cache=True: the machine code is written to __pycache__ on first
+# use, and later processes (including every render worker) load it instead of recompiling.
+try:
+    import numba
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    njit = None
+    prange = range
+    NUMBA_AVAILABLE = False
+    print("Warning: Numba not found. Pixel kernels will use the slower NumPy fallback.")
+    print("Install it using: pip install numba")
+
+# OpenCV is optional too: its SIMD gaussian blur is preferred over the box approximation.
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    cv2 = None
+    CV2_AVAILABLE = False
+
+# Number of box passes used to approximate a gaussian (3 is visually indistinguishable)
+BOX_BLUR_PASSES = 3
+
+# Scratch buffers reused across frames, keyed by (shape, name); one set per process
+_SCRATCH = {}
+
+
+def set_kernel_threads(count):
+    """Caps the threads the Numba and OpenCV kernels use in this process."""
+    count = max(1, int(count))
+    if NUMBA_AVAILABLE:
+        numba.set_num_threads(min(count, numba.config.NUMBA_NUM_THREADS))
+    if CV2_AVAILABLE:
+        cv2.setNumThreads(count)
+
+
+def scratch_buffer(name, shape):
+    """Returns a reusable uint8 array of the given shape (allocated once per process)."""
+    key = (name, shape)
+    buf = _SCRATCH.get(key)
+    if buf is None:
+        buf = _SCRATCH[key] = np.empty(shape, dtype=np.uint8)
+    return buf
+
+
+def box_radius_for_sigma(sigma, passes=BOX_BLUR_PASSES):
+    """Box radius whose `passes`-fold repetition approximates a gaussian of std dev `sigma`."""
+    ideal_width = math.sqrt(12.0 * sigma * sigma / passes + 1.0)
+    return max(0, int(round((ideal_width - 1.0) / 2.0)))
+
+
+# --- Box Blur Kernels (edge-replicate borders, rounded integer average) ---
+if NUMBA_AVAILABLE:
+    # Integer averages use a fixed-point reciprocal instead of a per-pixel division
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _box_blur_rows(src, dst, radius):
+        height, width, channels = src.shape
+        scale = (1 << 24) // (2 * radius + 1)
+        for y in prange(height):
+            for c in range(channels):
+                acc = np.int64(0)
+                for k in range(-radius, radius + 1):
+                    acc += src[y, min(max(k, 0), width - 1), c]
+                for x in range(width):
+                    dst[y, x, c] = (acc * scale + (1 << 23)) >> 24
+                    acc += np.int64(src[y, min(x + radius + 1, width - 1), c]) - src[y, max(x - radius, 0), c]
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _box_blur_cols(src, dst, radius):
+        height, width, channels = src.shape
+        scale = (1 << 24) // (2 * radius + 1)
+        block = 64  # Columns per task: rows of a block stay contiguous in memory
+        for b in prange((width + block - 1) // block):
+            x0 = b * block
+            x1 = min(x0 + block, width)
+            acc = np.zeros((x1 - x0, channels), dtype=np.int64)
+            for k in range(-radius, radius + 1):
+                yy = min(max(k, 0), height - 1)
+                for x in range(x0, x1):
+                    for c in range(channels):
+                        acc[x - x0, c] += src[yy, x, c]
+            for y in range(height):
+                y_add = min(y + radius + 1, height - 1)
+                y_sub = max(y - radius, 0)
+                for x in range(x0, x1):
+                    for c in range(channels):
+                        dst[y, x, c] = (acc[x - x0, c] * scale + (1 << 23)) >> 24
+                        acc[x - x0, c] += np.int64(src[y_add, x, c]) - src[y_sub, x, c]
+else:
+    def _box_blur_axis(src, dst, radius, axis):
+        window = 2 * radius + 1
+        pad = [(0, 0)] * src.ndim
+        pad[axis] = (radius + 1, radius)
+        padded = np.pad(src, pad, mode='edge').astype(np.int32)
+        csum = np.cumsum(padded, axis=axis)
+        n = src.shape[axis]
+        upper = np.take(csum, np.arange(window, window + n), axis=axis)
+        lower = np.take(csum, np.arange(0, n), axis=axis)
+        dst[...] = (upper - lower + radius) // window
+
+    def _box_blur_rows(src, dst, radius):
+        _box_blur_axis(src, dst, radius, 1)
+
+    def _box_blur_cols(src, dst, radius):
+        _box_blur_axis(src, dst, radius, 0)
+
+
+def box_blur_u8(src, dst, tmp, radius):
+    """One separable box blur of an HxWx3 uint8 array: rows src->tmp, then columns tmp->dst."""
+    _box_blur_rows(src, tmp, radius)
+    _box_blur_cols(tmp, dst, radius)
+
+
+def gaussian_blur_u8(src, sigma):
+    """Gaussian blur of an HxWx3 uint8 array (edge-replicated borders).
+
+    Uses OpenCV when installed, otherwise approximates the gaussian with repeated box blurs.
+    The result lives in a per-process scratch buffer that is overwritten by the next call.
+    """
+    out = scratch_buffer('blur_out', src.shape)
+    if CV2_AVAILABLE and sigma > 0:
+        cv2.GaussianBlur(src, (0, 0), sigmaX=sigma, dst=out, borderType=cv2.BORDER_REPLICATE)
+        return out
+    tmp = scratch_buffer('blur_tmp', src.shape)
+    radius = box_radius_for_sigma(sigma)
+    if radius <= 0:
+        np.copyto(out, src)
+        return out
+    box_blur_u8(src, out, tmp, radius)
+    for _ in range(BOX_BLUR_PASSES - 1):
+        box_blur_u8(out, out, tmp, radius)  # rows read `out` fully into `tmp` before it is rewritten
+    return out
+
+
+# --- Radial Mask Kernel ---
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _fill_radial_mask(out, center_x, center_y, sharp_radius, fade_radius):
+        height, width = out.shape
+        fade = max(fade_radius - sharp_radius, 1e-6)
+        for y in prange(height):
+            dy = y + 0.5 - center_y
+            for x in range(width):
+                dx = x + 0.5 - center_x
+                value = 255.0 * (1.0 - (math.sqrt(dx * dx + dy * dy) - sharp_radius) / fade)
+                out[y, x] = np.uint8(min(max(value, 0.0), 255.0) + 0.5)
+else:
+    def _fill_radial_mask(out, center_x, center_y, sharp_radius, fade_radius):
+        height, width = out.shape
+        fade = max(fade_radius - sharp_radius, 1e-6)
+        dy = np.arange(height)[:, None] + 0.5 - center_y
+        dx = np.arange(width)[None, :] + 0.5 - center_x
+        value = 255.0 * (1.0 - (np.hypot(dx, dy) - sharp_radius) / fade)
+        out[...] = (np.clip(value, 0.0, 255.0) + 0.5).astype(np.uint8)
+
+
+def build_radial_mask(width, height, center_x, center_y, sharp_radius, fade_radius):
+    """Returns an HxW uint8 mask: 255 inside sharp_radius, fading linearly to 0 at fade_radius."""
+    out = np.empty((height, width), dtype=np.uint8)
+    _fill_radial_mask(out, float(center_x), float(center_y), float(sharp_radius), float(fade_radius))
+    return out
+
+
+# --- Mask Composite Kernel ---
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def composite_u8(sharp, blurred, mask, out):
+        """out = sharp where mask is 255, blurred where it is 0, blended in between."""
+        height, width, channels = sharp.shape
+        for y in prange(height):
+            for x in range(width):
+                m = np.uint32(mask[y, x])
+                inv = 255 - m
+                for c in range(channels):
+                    out[y, x, c] = (sharp[y, x, c] * m + blurred[y, x, c] * inv + 127) // 255
+else:
+    def composite_u8(sharp, blurred, mask, out):
+        """out = sharp where mask is 255, blurred where it is 0, blended in between."""
+        m = mask[..., None].astype(np.uint16)
+        out[...] = (sharp * m + blurred * (255 - m) + 127) // 255
+
+
+def warmup_kernels():
+    """Compiles (or loads from the on-disk cache) every Numba kernel for the argument types
+    used while rendering, so that cost is not paid inside the first frame."""
+    if not NUMBA_AVAILABLE:
+        return
+    frame = np.zeros((8, 8, 3), dtype=np.uint8)
+    tmp = np.empty_like(frame)
+    out = np.empty_like(frame)
+    canvas = frame.copy()
+    canvas.flags.writeable = False # np.asarray() of a PIL canvas is read-only
+    box_blur_u8(canvas, out, tmp, 1)
+    box_blur_u8(out, out, tmp, 1)
+    mask = build_radial_mask(8, 8, 4.0, 4.0, 2.0, 4.0)
+    mask.flags.writeable = False # The cached radial mask is read-only
+    composite_u8(canvas, out, mask, out)